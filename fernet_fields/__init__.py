@@ -1,3 +1,5 @@
 from .fields import *  # noqa
+from .keyring import *  # noqa
+from .query import *  # noqa
 
 __version__ = '0.6'
@@ -0,0 +1,87 @@
+from collections import OrderedDict, namedtuple
+import threading
+
+from cryptography.fernet import Fernet, MultiFernet
+from django.conf import settings
+
+from . import hkdf
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+def key_fernet(key, use_hkdf=True):
+    """Build a Fernet from a single input key."""
+    if use_hkdf:
+        key = hkdf.derive_fernet_key(key)
+    return Fernet(key)
+
+
+def combine_fernets(fernets):
+    """Combine Fernets into one, with the first used for encryption."""
+    if len(fernets) == 1:
+        return fernets[0]
+    return MultiFernet(fernets)
+
+
+def build_fernet(keys, use_hkdf=True):
+    """Build a Fernet (or MultiFernet, for multiple keys) from input keys."""
+    return combine_fernets([key_fernet(k, use_hkdf) for k in keys])
+
+
+class FernetCache(object):
+    """A bounded, thread-safe LRU cache of Fernet objects keyed by key list.
+
+    If ``maxsize`` is not given, the ``FERNET_KEY_CACHE_SIZE`` setting is used
+    (default 1000).
+
+    """
+    def __init__(self, maxsize=None):
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self):
+        if self._maxsize is not None:
+            return self._maxsize
+        return getattr(settings, 'FERNET_KEY_CACHE_SIZE', 1000)
+
+    def get(self, keys, use_hkdf=True):
+        """Return a Fernet for ``keys``, deriving it only on a cache miss."""
+        cache_key = (tuple(keys), use_hkdf)
+        with self._lock:
+            fernet = self._data.pop(cache_key, None)
+            if fernet is not None:
+                self.hits += 1
+                self._data[cache_key] = fernet
+                return fernet
+            self.misses += 1
+        # Derive outside the lock; a concurrent miss for the same keys just
+        # does redundant work.
+        fernet = build_fernet(cache_key[0], use_hkdf)
+        with self._lock:
+            self._data[cache_key] = fernet
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return fernet
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def cache_info(self):
+        with self._lock:
+            return CacheInfo(
+                self.hits, self.misses, self.maxsize, len(self._data))
+
+    def cache_clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+
+fernet_cache = FernetCache()
@@ -1,11 +1,15 @@
-from cryptography.fernet import Fernet, MultiFernet
 from django.conf import settings
 from django.core.exceptions import FieldError, ImproperlyConfigured
+from django.core.signals import setting_changed
 from django.db import models
+from django.dispatch import receiver
 from django.utils.encoding import force_bytes, force_text
 from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
 
 from . import hkdf
+from .cache import build_fernet, fernet_cache
+from .keyring import KeyRing
 
 
 __all__ = [
@@ -19,11 +23,50 @@ __all__ = [
 ]
 
 
+_setting_objects = {}
+
+
+def get_setting_object(name, is_resolved):
+    """Return setting ``name``, importing it if given as a dotted path.
+
+    The result is cached until the setting changes, since it is needed for
+    every value encrypted or decrypted.
+
+    """
+    try:
+        return _setting_objects[name]
+    except KeyError:
+        pass
+    value = getattr(settings, name, None)
+    if value is not None and not is_resolved(value):
+        value = import_string(value)
+    _setting_objects[name] = value
+    return value
+
+
+def _is_key_ring(value):
+    return isinstance(value, KeyRing)
+
+
+@receiver(setting_changed)
+def _clear_setting_objects(setting, **kwargs):
+    _setting_objects.pop(setting, None)
+
+
 class EncryptedField(models.Field):
-    """A field that encrypts values using Fernet symmetric encryption."""
+    """A field that encrypts values using Fernet symmetric encryption.
+
+    If ``key_resolver`` (or the ``FERNET_KEY_RESOLVER`` setting) is given, it
+    is called with the field at encrypt and decrypt time and may return a list
+    of keys to use instead of the configured ones (or ``None`` to use them).
+    If the ``FERNET_KEY_RING`` setting is given, its keys are used in place of
+    ``FERNET_KEYS``.
+
+    """
     _internal_type = 'BinaryField'
 
     def __init__(self, *args, **kwargs):
+        self.key_resolver = kwargs.pop('key_resolver', None)
         if kwargs.get('primary_key'):
             raise ImproperlyConfigured(
                 "%s does not support primary_key=True."
@@ -56,9 +99,22 @@ class EncryptedField(models.Field):
 
     @cached_property
     def fernet(self):
-        if len(self.fernet_keys) == 1:
-            return Fernet(self.fernet_keys[0])
-        return MultiFernet([Fernet(k) for k in self.fernet_keys])
+        return build_fernet(self.fernet_keys, use_hkdf=False)
+
+    def get_fernet(self):
+        """Return the Fernet to use for the current (e.g. tenant) context."""
+        resolver = self.key_resolver
+        if resolver is None:
+            resolver = get_setting_object('FERNET_KEY_RESOLVER', callable)
+        if resolver is not None:
+            keys = resolver(self)
+            if keys is not None:
+                return fernet_cache.get(
+                    keys, getattr(settings, 'FERNET_USE_HKDF', True))
+        key_ring = get_setting_object('FERNET_KEY_RING', _is_key_ring)
+        if key_ring is not None:
+            return key_ring.get_fernet()
+        return self.fernet
 
     def get_internal_type(self):
         return self._internal_type
@@ -68,13 +124,14 @@ class EncryptedField(models.Field):
             EncryptedField, self
         ).get_db_prep_save(value, connection)
         if value is not None:
-            retval = self.fernet.encrypt(force_bytes(value))
+            retval = self.get_fernet().encrypt(force_bytes(value))
             return connection.Database.Binary(retval)
 
     def from_db_value(self, value, expression, connection, *args):
         if value is not None:
             value = bytes(value)
-            return self.to_python(force_text(self.fernet.decrypt(value)))
+            return self.to_python(
+                force_text(self.get_fernet().decrypt(value)))
 
     @cached_property
     def validators(self):
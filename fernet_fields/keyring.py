@@ -0,0 +1,126 @@
+from collections import namedtuple
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .cache import combine_fernets, key_fernet
+
+
+__all__ = [
+    'KeyRing',
+]
+
+
+logger = logging.getLogger(__name__)
+
+_State = namedtuple('_State', ['version', 'keys', 'fernets', 'fernet'])
+
+
+def file_version(stat):
+    """Identify a file's contents, including replacement by rename."""
+    mtime = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+    return (stat.st_ino, mtime, stat.st_size)
+
+
+class KeyRing(object):
+    """A reloadable set of keys, shared by all fields that use it.
+
+    ``source`` is either the path of a file containing one key per line
+    (blank lines and lines starting with ``#`` are ignored) or a callable
+    returning a list of keys. As with ``FERNET_KEYS``, the first key encrypts
+    and all keys are tried for decryption.
+
+    A file is checked for changes (inode, mtime or size) at most every
+    ``check_interval`` seconds; a callable is only re-read on an explicit
+    ``reload()``. Each reload swaps in a new cipher with a single assignment,
+    so readers never take a lock, and derived keys are reused for keys that
+    didn't change. If a changed file can't be loaded, a warning is logged and
+    the current keys are kept.
+
+    """
+    def __init__(self, source, use_hkdf=None, check_interval=1.0):
+        self.source = source
+        self.use_hkdf = use_hkdf
+        self.check_interval = check_interval
+        self._state = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return None if callable(self.source) else self.source
+
+    @property
+    def keys(self):
+        return self.get_state().keys
+
+    def get_fernet(self):
+        return self.get_state().fernet
+
+    def get_state(self):
+        state = self._state
+        if state is None or (
+                self.path is not None and time.time() >= self._next_check):
+            state = self.refresh()
+        return state
+
+    def refresh(self):
+        """Reload if the key file has changed since it was last loaded."""
+        # Don't block readers on a concurrent refresh; the current keys are
+        # still good while another thread checks for new ones.
+        if not self._lock.acquire(self._state is None):
+            return self._state
+        try:
+            if self._state is None:
+                return self._reload()
+            if self.path is None or time.time() < self._next_check:
+                return self._state
+            self._next_check = time.time() + self.check_interval
+            try:
+                if file_version(os.stat(self.path)) != self._state.version:
+                    return self._reload()
+            except (EnvironmentError, ImproperlyConfigured, ValueError):
+                logger.warning(
+                    "Could not reload keys from %s; keeping current keys.",
+                    self.path, exc_info=True)
+            return self._state
+        finally:
+            self._lock.release()
+
+    def reload(self):
+        """Unconditionally reload keys from the source."""
+        with self._lock:
+            return self._reload()
+
+    def _load(self):
+        if self.path is None:
+            return None, list(self.source())
+        with open(self.path) as fh:
+            version = file_version(os.fstat(fh.fileno()))
+            keys = [line.strip() for line in fh]
+        return version, [k for k in keys if k and not k.startswith('#')]
+
+    def _reload(self):
+        version, keys = self._load()
+        if not keys:
+            raise ImproperlyConfigured(
+                "KeyRing source %r provided no keys." % (self.source,))
+        use_hkdf = self.use_hkdf
+        if use_hkdf is None:
+            use_hkdf = getattr(settings, 'FERNET_USE_HKDF', True)
+        old = self._state.fernets if self._state is not None else {}
+        fernets = {}
+        for key in keys:
+            cache_key = (key, use_hkdf)
+            fernet = old.get(cache_key)
+            if fernet is None:
+                fernet = key_fernet(key, use_hkdf)
+            fernets[cache_key] = fernet
+        fernet = combine_fernets([fernets[(k, use_hkdf)] for k in keys])
+        self._state = _State(version, keys, fernets, fernet)
+        self._next_check = time.time() + self.check_interval
+        return self._state
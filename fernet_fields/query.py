@@ -0,0 +1,92 @@
+import heapq
+
+from django.db import models
+
+from .fields import EncryptedField
+
+
+__all__ = [
+    'EncryptedQuerySet',
+]
+
+
+class EncryptedQuerySet(models.QuerySet):
+    """A queryset with helpers for filtering/ordering by decrypted values.
+
+    Encrypted values can't be filtered or ordered in the database, so these
+    helpers do it in Python. Rows are streamed in chunks of ``chunk_size``,
+    and only the primary key and the needed columns are fetched and decrypted
+    until the matching rows are known.
+
+    """
+    chunk_size = 2000
+
+    def _encrypted_field_names(self):
+        return [
+            f.name for f in self.model._meta.concrete_fields
+            if isinstance(f, EncryptedField)
+        ]
+
+    def _iter_values(self, field_names, chunk_size=None):
+        """Yield ``(pk, value, ...)`` tuples, fetching ``chunk_size`` at once.
+
+        Paginates on primary key, so memory use is bounded by the chunk size
+        regardless of backend cursor behavior.
+
+        """
+        chunk_size = chunk_size or self.chunk_size
+        qs = self.order_by('pk').values_list('pk', *field_names)
+        last_pk = None
+        while True:
+            chunk_qs = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+            chunk = list(chunk_qs[:chunk_size])
+            for row in chunk:
+                yield row
+            if len(chunk) < chunk_size:
+                return
+            last_pk = chunk[-1][0]
+
+    def decrypted_filter(self, predicate, fields=None, chunk_size=None):
+        """Filter by a Python predicate applied to decrypted values.
+
+        ``predicate`` is called with a dict mapping each name in ``fields``
+        (default: all encrypted fields of the model) to its decrypted value,
+        and should return true for rows to keep. Returns a new queryset
+        filtered to the primary keys of matching rows.
+
+        The primary keys of all matches are held in memory and sent to the
+        database as a single ``IN`` clause, so this is meant for predicates
+        that match a modest number of rows; some backends (e.g. older SQLite)
+        limit the number of query parameters.
+
+        """
+        if fields is None:
+            fields = self._encrypted_field_names()
+        fields = list(fields)
+        pks = [
+            row[0] for row in self._iter_values(fields, chunk_size)
+            if predicate(dict(zip(fields, row[1:])))
+        ]
+        return self.filter(pk__in=pks)
+
+    def decrypted_top_k(self, field, k, chunk_size=None):
+        """Return the first ``k`` instances as ordered by decrypted ``field``.
+
+        As with ``order_by()``, prefix ``field`` with ``-`` for descending
+        order. Rows whose value is ``None`` are skipped. Only ``k`` candidates
+        are held in memory while scanning; full instances are fetched for the
+        winning rows only, and returned as a list.
+
+        """
+        descending = field.startswith('-')
+        field = field.lstrip('-')
+        rows = (
+            row for row in self._iter_values([field], chunk_size)
+            if row[1] is not None
+        )
+        select = heapq.nlargest if descending else heapq.nsmallest
+        winners = select(k, rows, key=lambda row: row[1])
+        pks = [row[0] for row in winners]
+        objs = dict((obj.pk, obj) for obj in self.filter(pk__in=pks))
+        # Rows deleted since the scan are skipped.
+        return [objs[pk] for pk in pks if pk in objs]
@@ -1,8 +1,17 @@
+import threading
+
 from django.db import models
 
 import fernet_fields as fields
 
 
+tenant = threading.local()
+
+
+def tenant_keys(field):
+    return getattr(tenant, 'keys', None)
+
+
 class EncryptedText(models.Model):
     value = fields.EncryptedTextField()
 
@@ -18,6 +27,8 @@ class EncryptedEmail(models.Model):
 class EncryptedInt(models.Model):
     value = fields.EncryptedIntegerField()
 
+    objects = fields.EncryptedQuerySet.as_manager()
+
 
 class EncryptedDate(models.Model):
     value = fields.EncryptedDateField()
@@ -29,3 +40,9 @@ class EncryptedDateTime(models.Model):
 
 class EncryptedNullable(models.Model):
     value = fields.EncryptedIntegerField(null=True)
+
+    objects = fields.EncryptedQuerySet.as_manager()
+
+
+class EncryptedTenant(models.Model):
+    value = fields.EncryptedTextField(key_resolver=tenant_keys)
@@ -1,12 +1,16 @@
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
 from datetime import date, datetime
+import os
 
 from django.core.exceptions import FieldError, ImproperlyConfigured
 from django.db import connection, models as dj_models
+from django.db.migrations.state import ModelState
 from django.utils.encoding import force_bytes, force_text
 import pytest
 
 import fernet_fields as fields
+from fernet_fields.cache import FernetCache
+from fernet_fields.keyring import KeyRing
 from . import models
 
 
@@ -50,6 +54,62 @@ class TestEncryptedField(object):
         with pytest.raises(ImproperlyConfigured):
             fields.EncryptedIntegerField(**{key: True})
 
+    def test_key_resolver(self):
+        """A key_resolver can supply keys at encrypt/decrypt time."""
+        f = fields.EncryptedTextField(key_resolver=lambda field: ['tenant'])
+        g = fields.EncryptedTextField()
+
+        with pytest.raises(InvalidToken):
+            g.get_fernet().decrypt(f.get_fernet().encrypt(b'foo'))
+
+    def test_key_resolver_none_falls_back(self):
+        """A key_resolver returning None uses the configured keys."""
+        f = fields.EncryptedTextField(key_resolver=lambda field: None)
+
+        assert f.get_fernet() is f.fernet
+
+    def test_key_resolver_from_settings(self, settings):
+        """Can set FERNET_KEY_RESOLVER to a dotted path."""
+        settings.FERNET_KEY_RESOLVER = 'fernet_fields.test.models.tenant_keys'
+        models.tenant.keys = ['tenant']
+        try:
+            fernet = fields.EncryptedTextField().get_fernet()
+        finally:
+            del models.tenant.keys
+
+        assert fernet is fields.EncryptedTextField(
+            key_resolver=lambda field: ['tenant']).get_fernet()
+
+    def test_key_resolver_setting_change(self, settings):
+        """Cached FERNET_KEY_RESOLVER is cleared when the setting changes."""
+        f = fields.EncryptedTextField()
+        settings.FERNET_KEY_RESOLVER = lambda field: ['tenant1']
+        first = f.get_fernet()
+        settings.FERNET_KEY_RESOLVER = lambda field: ['tenant2']
+
+        assert f.get_fernet() is not first
+        settings.FERNET_KEY_RESOLVER = None
+        assert f.get_fernet() is f.fernet
+
+    def test_key_resolver_not_deconstructed(self):
+        """key_resolver is runtime-only and not written to migrations."""
+        f = fields.EncryptedTextField(key_resolver=lambda field: None)
+
+        assert 'key_resolver' not in f.deconstruct()[3]
+
+    def test_key_resolver_dropped_from_historical_models(self, settings):
+        """Historical models lose key_resolver; FERNET_KEY_RESOLVER applies."""
+        state = ModelState.from_model(models.EncryptedTenant)
+        historical = dict(state.fields)['value']
+        clone = models.EncryptedTenant._meta.get_field('value').clone()
+
+        assert historical.key_resolver is None
+        assert clone.key_resolver is None
+        assert clone.get_fernet() is clone.fernet
+        settings.FERNET_KEY_RESOLVER = lambda field: ['tenant']
+        assert clone.get_fernet() is fields.EncryptedTextField(
+            key_resolver=lambda field: ['tenant']).get_fernet()
+
     def test_get_integer_field_validators(self):
         f = fields.EncryptedIntegerField()
 
@@ -140,3 +200,233 @@ def test_isnull_true_lookup(db):
     found = models.EncryptedNullable.objects.get(value__isnull=True)
 
     assert found.value is None
+
+
+class TestEncryptedQuerySet(object):
+    @pytest.fixture
+    def objs(self, db):
+        return [
+            models.EncryptedInt.objects.create(value=v)
+            for v in [5, 3, 9, 1, 7]
+        ]
+
+    def test_decrypted_filter(self, objs):
+        """Filters by a predicate on decrypted values."""
+        qs = models.EncryptedInt.objects.decrypted_filter(
+            lambda v: v['value'] > 4, chunk_size=2)
+
+        assert sorted(o.value for o in qs) == [5, 7, 9]
+
+    def test_decrypted_filter_respects_queryset(self, objs):
+        """Only rows already in the queryset are considered."""
+        qs = models.EncryptedInt.objects.exclude(pk=objs[0].pk)
+        found = qs.decrypted_filter(lambda v: v['value'] > 4)
+
+        assert sorted(o.value for o in found) == [7, 9]
+
+    def test_decrypted_top_k(self, objs):
+        """Returns first k instances ordered by decrypted value."""
+        found = models.EncryptedInt.objects.decrypted_top_k(
+            'value', 3, chunk_size=2)
+
+        assert [o.value for o in found] == [1, 3, 5]
+
+    def test_decrypted_top_k_descending(self, objs):
+        """A '-' prefix orders descending."""
+        found = models.EncryptedInt.objects.decrypted_top_k('-value', 2)
+
+        assert [o.value for o in found] == [9, 7]
+
+    def test_decrypted_top_k_skips_deleted(self, objs, monkeypatch):
+        """Winning rows deleted before the final fetch are skipped."""
+        qs = models.EncryptedInt.objects.all()
+        iter_values = qs._iter_values
+
+        def scan_then_delete(*args):
+            rows = list(iter_values(*args))
+            objs[3].delete()
+            return iter(rows)
+
+        monkeypatch.setattr(qs, '_iter_values', scan_then_delete)
+        found = qs.decrypted_top_k('value', 2)
+
+        assert [o.value for o in found] == [3]
+
+    def test_decrypted_top_k_skips_null(self, db):
+        """Rows with a None value are skipped."""
+        models.EncryptedNullable.objects.create(value=None)
+        models.EncryptedNullable.objects.create(value=2)
+        found = models.EncryptedNullable.objects.decrypted_top_k('value', 5)
+
+        assert [o.value for o in found] == [2]
+
+
+key_ring = KeyRing(lambda: ['ring1'])
+
+
+class TestKeyRing(object):
+    def write_keys(self, path, keys, mtime):
+        path.write_text(u'\n'.join(keys), 'ascii')
+        os.utime(str(path), (mtime, mtime))
+
+    def test_load_from_file(self, tmpdir):
+        """Reads one key per line, ignoring blanks and comments."""
+        path = tmpdir.join('keys')
+        self.write_keys(path, ['# comment', 'key1', '', 'key2'], 1000)
+        ring = KeyRing(str(path))
+
+        assert ring.keys == ['key1', 'key2']
+
+    def test_reload_on_mtime_change(self, tmpdir):
+        """A changed file is picked up, reusing unchanged derivations."""
+        path = tmpdir.join('keys')
+        self.write_keys(path, ['key1'], 1000)
+        ring = KeyRing(str(path), check_interval=0)
+        token = ring.get_fernet().encrypt(b'foo')
+        old = ring.get_state().fernets
+
+        self.write_keys(path, ['key2', 'key1'], 2000)
+
+        assert ring.keys == ['key2', 'key1']
+        assert ring.get_fernet().decrypt(token) == b'foo'
+        assert ring.get_state().fernets[('key1', True)] is old[('key1', True)]
+
+    def test_reload_on_rename_with_same_mtime(self, tmpdir):
+        """A file renamed over the key file is picked up despite its mtime."""
+        path = tmpdir.join('keys')
+        new = tmpdir.join('keys.new')
+        self.write_keys(path, ['key1'], 1000)
+        ring = KeyRing(str(path), check_interval=0)
+        ring.keys
+        self.write_keys(new, ['key2', 'key1'], 1000)
+        new.rename(path)
+
+        assert ring.keys == ['key2', 'key1']
+
+    def test_empty_file_keeps_keys(self, tmpdir, caplog):
+        """A changed file with no keys logs a warning; keys are kept."""
+        path = tmpdir.join('keys')
+        self.write_keys(path, ['key1'], 1000)
+        ring = KeyRing(str(path), check_interval=0)
+        fernet = ring.get_fernet()
+        self.write_keys(path, [], 2000)
+
+        assert ring.get_fernet() is fernet
+        assert 'Could not reload keys' in caplog.text
+
+    def test_missing_file_keeps_keys(self, tmpdir, caplog):
+        """A missing file logs a warning; keys are kept."""
+        path = tmpdir.join('keys')
+        self.write_keys(path, ['key1'], 1000)
+        ring = KeyRing(str(path), check_interval=0)
+        fernet = ring.get_fernet()
+        path.remove()
+
+        assert ring.get_fernet() is fernet
+        assert 'Could not reload keys' in caplog.text
+
+    def test_initial_load_raises(self, tmpdir):
+        ring = KeyRing(str(tmpdir.join('missing')))
+
+        with pytest.raises(EnvironmentError):
+            ring.get_fernet()
+
+    def test_no_reload_within_check_interval(self, tmpdir):
+        path = tmpdir.join('keys')
+        self.write_keys(path, ['key1'], 1000)
+        ring = KeyRing(str(path), check_interval=3600)
+        ring.keys
+        self.write_keys(path, ['key2'], 2000)
+
+        assert ring.keys == ['key1']
+        ring.reload()
+        assert ring.keys == ['key2']
+
+    def test_callable_explicit_reload(self):
+        """A callable source is only re-read on reload()."""
+        keys = ['key1']
+        ring = KeyRing(lambda: keys)
+        fernet = ring.get_fernet()
+        keys = ['key2']
+
+        assert ring.get_fernet() is fernet
+        ring.reload()
+        assert ring.keys == ['key2']
+
+    def test_no_keys(self):
+        ring = KeyRing(lambda: [])
+
+        with pytest.raises(ImproperlyConfigured):
+            ring.get_fernet()
+
+    def test_field_uses_key_ring(self, settings):
+        """FERNET_KEY_RING overrides FERNET_KEYS for all fields."""
+        settings.FERNET_KEY_RING = 'fernet_fields.test.test_fields.key_ring'
+        f = fields.EncryptedTextField()
+
+        assert f.get_fernet() is key_ring.get_fernet()
+
+    def test_key_ring_setting_change(self, settings):
+        """Cached FERNET_KEY_RING is cleared when the setting changes."""
+        other = KeyRing(lambda: ['ring2'])
+        f = fields.EncryptedTextField()
+        settings.FERNET_KEY_RING = key_ring
+        f.get_fernet()
+        settings.FERNET_KEY_RING = other
+
+        assert f.get_fernet() is other.get_fernet()
+
+    def test_resolver_takes_precedence(self, settings):
+        settings.FERNET_KEY_RING = key_ring
+        f = fields.EncryptedTextField(key_resolver=lambda field: ['tenant'])
+
+        assert f.get_fernet() is not key_ring.get_fernet()
+
+
+class TestFernetCache(object):
+    def test_reuses_fernet(self):
+        """Same keys return the same Fernet object and count as a hit."""
+        cache = FernetCache(maxsize=2)
+        f = cache.get(['a'])
+
+        assert cache.get(['a']) is f
+        assert cache.cache_info() == (1, 1, 2, 1)
+        assert cache.hit_rate == 0.5
+
+    def test_evicts_least_recently_used(self):
+        cache = FernetCache(maxsize=2)
+        a = cache.get(['a'])
+        cache.get(['b'])
+        cache.get(['a'])
+        cache.get(['c'])
+
+        assert cache.cache_info().currsize == 2
+        assert cache.get(['a']) is a
+        assert cache.cache_info().misses == 3
+        cache.get(['b'])
+        assert cache.cache_info().misses == 4
+
+    def test_maxsize_from_settings(self, settings):
+        settings.FERNET_KEY_CACHE_SIZE = 7
+
+        assert FernetCache().maxsize == 7
+
+    def test_cache_clear(self):
+        cache = FernetCache()
+        cache.get(['a'])
+        cache.cache_clear()
+
+        assert cache.cache_info() == (0, 0, 1000, 0)
+
+
+def test_tenant_isolation(db):
+    """Each tenant's data is encrypted with that tenant's key."""
+    models.tenant.keys = ['tenant1']
+    try:
+        models.EncryptedTenant.objects.create(value='foo')
+        assert models.EncryptedTenant.objects.get().value == 'foo'
+        models.tenant.keys = ['tenant2']
+        with pytest.raises(InvalidToken):
+            models.EncryptedTenant.objects.get()
+    finally:
+        del models.tenant.keys